@@ -1,15 +1,134 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import atexit
+import io
+import ipaddress
+import itertools
 import json
 import os
-import traceback
+import re
+import string
+import threading
+from contextlib import ExitStack
+from datetime import date, time
+from decimal import Decimal
+from functools import lru_cache, wraps
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, jsonify, request
+from flask.json.provider import JSONProvider
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date
+
+import orjson
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.sql import SQL, Composed, Identifier
+
+from psycopg_pool import ConnectionPool
+
+_ip_types = (
+    ipaddress.IPv4Address,
+    ipaddress.IPv6Address,
+    ipaddress.IPv4Network,
+    ipaddress.IPv6Network,
+)
+
+
+def orjson_default(obj):
+    """
+    Serializes the types returned by psycopg which orjson
+    can't handle natively (UUID is supported by orjson)
+    """
+    # dates are formatted like Flask's JSON encoder did, not as ISO 8601
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, time):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    # bytea values, in PostgreSQL's hex format
+    if isinstance(obj, (bytes, memoryview)):
+        return "\\x" + obj.hex()
+    # inet and cidr values, which psycopg2 returned as strings
+    if isinstance(obj, _ip_types):
+        return str(obj)
+    raise TypeError
+
+
+def orjson_dumps(obj):
+    """
+    Encodes 'obj' as JSON bytes
+    """
+    # datetime, date and time are passed to orjson_default
+    return orjson.dumps(
+        obj, default=orjson_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+    )
+
+
+# Matches 19 digits in a row, i.e. numbers which might not fit into 64 bits
+# (-2**63 - 1 has only 19 digits)
+_long_number = re.compile(rb"\d{19}")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    JSON provider which uses orjson for parsing request bodies
+    and encoding responses
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson_dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if isinstance(s, str):
+            s = s.encode("utf-8")
+        # orjson turns integers beyond 64 bits into floats, json keeps them exact
+        if _long_number.search(s):
+            return json.loads(s)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson_dumps(obj),
+            mimetype="application/json",
+        )
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Request bodies are parsed in memory, hence limit their size
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.environ.get("MAX_CONTENT_LENGTH", 32 * 1024 * 1024)
+)
+
+
+@app.before_request
+def check_content_length():
+    """
+    Rejects too large request bodies before they are read.
+    Werkzeug only enforces MAX_CONTENT_LENGTH for form data.
+    """
+    max_length = app.config["MAX_CONTENT_LENGTH"]
+    content_length = request.content_length
+    if content_length is not None:
+        if content_length > max_length:
+            abort(413)
+        return
+
+    # chunked bodies have no length, read them up to one byte beyond the limit
+    body = bytearray()
+    while len(body) <= max_length:
+        chunk = request.stream.read(max_length + 1 - len(body))
+        if not chunk:
+            break
+        body += chunk
+    if len(body) > max_length:
+        abort(413)
+    # the stream has been consumed, hence hand on the body from memory
+    request.stream = io.BytesIO(body)
 
 
 def postgres_dsn():
@@ -19,32 +138,248 @@ def postgres_dsn():
     return os.environ.get("POSTGRES_DSN")
 
 
+class CachingConnection(psycopg.Connection):
+    """
+    A connection which remembers the schema generation its prepared
+    statements belong to
+    """
+
+    stmt_generation = 0
+
+
+# Maximum number of prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 500
+
+_stmt_generations = itertools.count(1)
+_stmt_generation = 0
+
+# Statements which can't change the schema of a table
+_dml_keywords = (
+    "SELECT",
+    "WITH",
+    "INSERT",
+    "UPDATE",
+    "DELETE",
+    "VALUES",
+    "SHOW",
+    "EXPLAIN",
+)
+
+
+def invalidate_statements():
+    """
+    Marks the prepared statements of all connections as stale,
+    e.g. after a table has been dropped or created
+    """
+    global _stmt_generation
+    _stmt_generation = next(_stmt_generations)
+
+
+def invalidate_statements_for(query):
+    """
+    Invalidates the prepared statements if the query might be DDL
+    """
+    if not query.lstrip().upper().startswith(_dml_keywords):
+        invalidate_statements()
+
+
+def configure_connection(conn):
+    """
+    Called by the pool for every new connection
+    """
+    conn.prepared_max = STATEMENT_CACHE_SIZE
+    conn.stmt_generation = _stmt_generation
+
+
+def check_connection(conn):
+    """
+    Called by the pool before a connection is handed out.
+    Statements prepared before the last schema change are deallocated,
+    as their cached plans might return outdated columns.
+    """
+    if conn.stmt_generation != _stmt_generation:
+        # psycopg deallocates its prepared statements on rollback
+        with conn.transaction(force_rollback=True):
+            pass
+        conn.stmt_generation = _stmt_generation
+
+
+# Raised by PostgreSQL for prepared statements whose columns have changed
+_stale_statement_message = "cached plan must not change result type"
+
+
+def retry_stale_statements(endpoint):
+    """
+    Runs an endpoint once more if a prepared statement turned out to be stale,
+    e.g. after a schema change by another worker process or a migration.
+    """
+
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        try:
+            return endpoint(*args, **kwargs)
+        except psycopg.errors.FeatureNotSupported as e:
+            if e.diag.message_primary != _stale_statement_message:
+                raise
+            # the failed transaction has been rolled back already
+            invalidate_statements()
+            return endpoint(*args, **kwargs)
+
+    return wrapper
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def postgres_pool():
+    """
+    Returns the connection pool for postgres, creating it on first use
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                max_size = int(os.environ.get("PG_POOL_MAX", 20))
+                _pool = ConnectionPool(
+                    postgres_dsn(),
+                    connection_class=CachingConnection,
+                    kwargs={"row_factory": dict_row},
+                    min_size=min(int(os.environ.get("PG_POOL_MIN", 2)), max_size),
+                    max_size=max_size,
+                    configure=configure_connection,
+                    check=check_connection,
+                    open=True,
+                )
+    return _pool
+
+
+@atexit.register
+def close_postgres_pool():
+    """
+    Closes all pooled connections
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
 class SimplePostgres:
     """
-    Provides a cursor to a connection to a Postgres instance
+    Provides a cursor to a pooled connection to a Postgres instance
     in a 'with' context.
+    A server-side cursor is used if a cursor name is given.
+    Read-only queries run in autocommit mode, which saves the round trips
+    for BEGIN and COMMIT. Otherwise the connection is in pipeline mode
+    unless disabled, so that BEGIN is sent along with the first query.
     """
 
+    def __init__(self, cursor_name="", readonly=False, pipeline=True):
+        self.cursor_name = cursor_name
+        self.readonly = readonly
+        self.pipeline = pipeline
+
     def __enter__(self):
         """
-        Starts a connection to a Postgres instance
+        Checks out a connection to a Postgres instance from the pool
         """
-        self.conn = psycopg2.connect(postgres_dsn(), cursor_factory=RealDictCursor)
-        self.cursor = self.conn.cursor()
+        self.pool = postgres_pool()
+        self.conn = self.pool.getconn()
+        with ExitStack() as stack:
+            stack.callback(self.release)
+            self.conn.autocommit = self.readonly
+            # server-side cursors can't be used in pipeline mode
+            if self.pipeline and not self.readonly and not self.cursor_name:
+                stack.enter_context(self.conn.pipeline())
+            self.cursor = self.conn.cursor(name=self.cursor_name)
+            self.stack = stack.pop_all()
         return self.cursor
 
     def __exit__(self, exc_type, exc_value, traceback):
-        try:
-            self.conn.commit()
         # There's a global exception listener, so we want to re-raise
         # the exceptions.
         # However, we need to make sure that all connections and cursors
         # are properly closed
-        except Exception as e:
-            raise e
-        finally:
+        with self.stack:
+            # server-side cursors don't outlive the transaction
             self.cursor.close()
-            self.conn.close()
+            if self.readonly:
+                return
+            if exc_type is None:
+                try:
+                    self.conn.commit()
+                    return
+                except psycopg.Error:
+                    # pipelined statements might only fail on commit
+                    self.rollback()
+                    raise
+            self.rollback()
+
+    def rollback(self):
+        """
+        Makes sure that no aborted transaction is handed out to the next user
+        """
+        if not self.conn.closed:
+            self.conn.rollback()
+
+    def release(self):
+        """
+        Returns the connection to the pool, which discards broken connections
+        """
+        # autocommit isn't reset, as it is set on every checkout
+        self.pool.putconn(self.conn)
+
+
+def client_query(cur, query, args):
+    """
+    Binds the parameters of a query on the client like psycopg2 did,
+    e.g. 'SELECT %s' keeps the type of its parameter
+    """
+    return psycopg.ClientCursor(cur.connection).mogrify(query, args)
+
+
+# Number of rows which are fetched and encoded at once when streaming
+STREAM_CHUNK_SIZE = 1000
+
+# Statements which can be run on a server-side cursor
+_streamable_keywords = ("SELECT", "VALUES")
+
+# Statements which don't need to be committed
+_readonly_keywords = ("WITH", "SHOW", "EXPLAIN")
+
+
+def stream_rows(stack, rows):
+    """
+    Streams the rows of a query, given as an iterator, as a JSON array.
+    The connection held by 'stack' is released after the last row.
+    """
+
+    def fetch_chunk():
+        # strip the brackets of the encoded list
+        chunk = list(itertools.islice(rows, STREAM_CHUNK_SIZE))
+        return orjson_dumps(chunk)[1:-1]
+
+    # fetch and encode the first rows eagerly, so that errors can still be
+    # reported before the response has started
+    chunk = fetch_chunk()
+    stack = stack.pop_all()
+
+    def generate(chunk):
+        with stack:
+            yield b"["
+            separator = b""
+            while chunk:
+                yield separator + chunk
+                separator = b","
+                chunk = fetch_chunk()
+            yield b"]"
+
+    response = Response(generate(chunk), mimetype="application/json")
+    # release the connection if the response is never iterated
+    response.call_on_close(stack.close)
+    return response
 
 
 @app.route("/execute", methods=["post"])
@@ -52,9 +387,42 @@ def execute():
     req = request.json
     query = req["query"]
     args = req.get("data", {})
-    with SimplePostgres() as cur:
-        cur.execute(query, args)
-        return jsonify(cur.fetchall())
+    prefix = query.lstrip()[:16].upper()
+    if prefix.startswith(_streamable_keywords):
+        try:
+            # server-side cursors require a transaction
+            with ExitStack() as stack:
+                cur = stack.enter_context(SimplePostgres(cursor_name="stream"))
+                cur.itersize = STREAM_CHUNK_SIZE
+                cur.execute(client_query(cur, query, args))
+                return stream_rows(stack, iter(cur))
+        except psycopg.errors.SyntaxError:
+            # e.g. 'SELECT ... INTO' or several statements can't be declared
+            # as a cursor, but might still run as a plain query
+            pass
+
+    readonly = prefix.startswith(_readonly_keywords)
+    try:
+        # pipeline mode can't run several statements in one query
+        with SimplePostgres(readonly=readonly, pipeline=False) as cur:
+            cur.execute(client_query(cur, query, args), prepare=False)
+            # like psycopg2, return the rows of the last statement
+            while cur.nextset():
+                pass
+            # e.g. DDL doesn't return rows
+            if cur.description is None:
+                return jsonify([])
+            return jsonify(cur.fetchall())
+    finally:
+        invalidate_statements_for(query)
+
+
+@lru_cache(maxsize=256)
+def values_template(count):
+    """
+    Returns the placeholder tuple for a row of 'count' values
+    """
+    return f"({','.join(['%s'] * count)})"
 
 
 class InsertBuilder:
@@ -73,32 +441,50 @@ class InsertBuilder:
         if self.first_item is None:
             self.first_item = items
 
-        self.params.extend(map(lambda x: x[1], items))
-        self.value_strs.append(f"({','.join(map(lambda x: '%s', values))})")
+        self.params.extend([v for _, v in items])
+        self.value_strs.append(values_template(len(items)))
 
     def names(self):
-        return ",".join(map(lambda x: f'"{x[0]}"', self.first_item))
+        return SQL(",").join([Identifier(k) for k, _ in self.first_item])
 
     def values(self):
-        return ",".join(self.value_strs)
+        return SQL(",".join(self.value_strs))
+
+
+def sql_table(table):
+    """
+    Build the SQL identifier of an optionally schema-qualified table.
+    """
+    return Identifier(*table.split("."))
 
 
 def sql_columns(columns):
     """
-    Build a SQL string of column names.
+    Build a SQL list of column names.
     """
     if columns is None:
-        return "*"
+        return SQL("*")
 
     assert isinstance(columns, list)
-    # validate columns
+    # e.g. lists can't be cached
+    assert all(isinstance(c, str) for c in columns)
+    return quoted_columns(tuple(columns))
+
+
+@lru_cache(maxsize=2048)
+def quoted_columns(columns):
+    """
+    Validates and quotes a tuple of column names.
+    Clients tend to send the same columns over and over.
+    """
     for column in columns:
         assert check_valid_sql_ident(column)
 
-    return ",".join(f'"{col}"' for col in columns)
+    return SQL(",").join(map(Identifier, columns))
 
 
 @app.route("/insert", methods=["post"])
+@retry_stale_statements
 def insert():
     req = request.json
     table = req["table"]
@@ -115,17 +501,16 @@ def insert():
 
     builder = InsertBuilder()
     builder.add(value)
-    returning = sql_columns(returning)
-    sql = (
-        f"INSERT INTO {table} ({builder.names()}) "
-        f"VALUES {builder.values()} RETURNING {returning}"
+    sql = SQL("INSERT INTO {} ({}) VALUES {} RETURNING {}").format(
+        sql_table(table), builder.names(), builder.values(), sql_columns(returning)
     )
     with SimplePostgres() as cur:
-        cur.execute(sql, builder.params)
+        cur.execute(sql, builder.params, prepare=True)
         return jsonify(cur.fetchone())
 
 
 @app.route("/insertMany", methods=["post"])
+@retry_stale_statements
 def insertMany():
     req = request.json
     table = req["table"]
@@ -134,23 +519,42 @@ def insertMany():
     return _insertMany(table, values, returning)
 
 
+# Maximum number of rows inserted by a single statement
+INSERT_PAGE_SIZE = 1000
+
+# PostgreSQL's limit of parameters per statement
+MAX_STATEMENT_PARAMS = 65535
+
+
 def _insertMany(table, values, returning):
     """
     Allows to insert multiple values into a table.
     """
-    builder = InsertBuilder()
     # allow one or multiple insert entries
     assert isinstance(values, list)
-    for e in values:
-        builder.add(e)
-    returning = sql_columns(returning)
-    sql = (
-        f"INSERT INTO {table} ({builder.names()}) "
-        f"VALUES {builder.values()} RETURNING {returning}"
-    )
+    assert len(values) > 0
+    # the column names are taken from the first entry
+    columns = values[0].keys()
+    # otherwise values would be dropped silently
+    for value in values:
+        assert value.keys() == columns, "All values need the same columns."
+    page_size = min(INSERT_PAGE_SIZE, MAX_STATEMENT_PARAMS // max(len(columns), 1))
+    result = []
     with SimplePostgres() as cur:
-        cur.execute(sql, builder.params)
-        return jsonify(cur.fetchall())
+        # every page of rows is inserted by a single multi-row statement
+        for i in range(0, len(values), page_size):
+            builder = InsertBuilder()
+            for value in values[i : i + page_size]:
+                builder.add(value)
+            sql = SQL("INSERT INTO {} ({}) VALUES {} RETURNING {}").format(
+                sql_table(table),
+                builder.names(),
+                builder.values(),
+                sql_columns(returning),
+            )
+            cur.execute(sql, builder.params)
+            result.extend(cur.fetchall())
+        return jsonify(result)
 
 
 class QueryBuilder:
@@ -159,78 +563,81 @@ class QueryBuilder:
     """
 
     operators = {
-        "$gt": ">",
-        "$gte": ">=",
-        "$lt": "<",
-        "$lte": "<=",
-        "$eq": "=",
+        "$gt": SQL(" > %s"),
+        "$gte": SQL(" >= %s"),
+        "$lt": SQL(" < %s"),
+        "$lte": SQL(" <= %s"),
+        "$eq": SQL(" = %s"),
     }
 
+    actions = {"$and": SQL(" AND "), "$or": SQL(" OR ")}
+
+    open_group = SQL("(")
+    close_group = SQL(")")
+    equals = SQL("=%s")
+
     def __init__(self):
         self.params = []
-        self.current_column = None
-
-    def group(self, value, action):
-        query = self.build(value)
-        return f" {action} ".join(query)
-
-    def op(self, op, v):
-        assert self.current_column is not None
-        self.params.append(v)
-        op = QueryBuilder.operators[op]
-        return f'"{self.current_column}" {op} %s'
-
-    def build(self, where):
-        query = []
-        for k, v in where.items():
-            if k == "$and":
-                query.append(self.group(v, "AND"))
-            elif k == "$or":
-                query.append(self.group(v, "OR"))
+        self.tokens = []
+
+    def emit(self, where, separator, column=None):
+        """
+        Appends the conditions in 'where' joined by 'separator' to the tokens
+        """
+        for i, (k, v) in enumerate(where.items()):
+            if i > 0:
+                self.tokens.append(separator)
+            if k in QueryBuilder.actions:
+                self.group(v, QueryBuilder.actions[k], column)
+            elif k in QueryBuilder.operators:
+                assert column is not None
+                self.tokens.append(Identifier(column))
+                self.tokens.append(QueryBuilder.operators[k])
+                self.params.append(v)
+            elif isinstance(v, dict):
+                assert column is None, f"Fields in '{column}' can't be nested."
+                self.group(v, QueryBuilder.actions["$and"], k)
             else:
-                if k in QueryBuilder.operators:
-                    query.append(self.op(k, v))
-                elif isinstance(v, dict):
-                    assert (
-                        self.current_column is None
-                    ), f"Fields in '{self.current_column}' can't be nested."
-                    old_current_column = self.current_column
-                    self.current_column = k
-                    query.append(self.group(v, "AND"))
-                    self.current_column = old_current_column
-                else:
-                    query.append(f"{k}=%s")
-                    self.params.append(v)
-
-        return query
+                self.tokens.append(Identifier(k))
+                self.tokens.append(QueryBuilder.equals)
+                self.params.append(v)
+
+    def group(self, where, separator, column):
+        self.tokens.append(QueryBuilder.open_group)
+        self.emit(where, separator, column)
+        self.tokens.append(QueryBuilder.close_group)
 
     @staticmethod
     def build_query(where):
         if where is None or len(where) == 0:
-            return {"query": "", "params": []}
+            return {"query": SQL(""), "params": []}
 
         builder = QueryBuilder()
-        query = builder.group(where, "AND")
-        return {"query": query, "params": builder.params}
+        builder.emit(where, QueryBuilder.actions["$and"])
+        return {"query": Composed(builder.tokens), "params": builder.params}
 
 
 @app.route("/delete", methods=["post"])
+@retry_stale_statements
 def delete():
     req = request.json
     table = req["table"]
     where = req.get("where", None)
 
-    where_str = ""
+    sql = SQL("DELETE FROM {}").format(sql_table(table))
     query = QueryBuilder.build_query(where)
     if len(query["params"]) > 0:
-        where_str = f"WHERE ({query['query']}) "
-
-    sql = f"DELETE FROM {table} {where_str} RETURNING *"
+        sql += SQL(" WHERE ({})").format(query["query"])
+    sql += SQL(" RETURNING *")
     with SimplePostgres() as cur:
-        cur.execute(sql, query["params"])
+        cur.execute(sql, query["params"], prepare=True)
         return jsonify(cur.fetchall())
 
 
+# Deletes all characters which are allowed in an identifier
+_delete_ident_chars = str.maketrans("", "", string.ascii_letters + string.digits + "_$")
+
+
 def check_valid_sql_ident(ident):
     """
     https://www.postgresql.org/docs/9.6/sql-syntax-lexical.html#SQL-SYNTAX-IDENTIFIERS
@@ -241,10 +648,7 @@ def check_valid_sql_ident(ident):
         return False
     if not ident[0].isalnum():
         return False
-    for c in ident:
-        if not (c.isalnum() or c in "_$"):
-            return False
-    return True
+    return len(ident.translate(_delete_ident_chars)) == 0
 
 
 @app.route("/select", methods=["post"])
@@ -253,48 +657,89 @@ def select():
     table = req["table"]
     where = req.get("where", None)
     columns = req.get("columns", None)
-    columns = sql_columns(columns)
 
-    sql = f"SELECT {columns} FROM {table}"
+    sql = SQL("SELECT {} FROM {}").format(sql_columns(columns), sql_table(table))
     query = QueryBuilder.build_query(where)
     if len(query["params"]) > 0:
-        sql += f" WHERE ({query['query']})"
-    with SimplePostgres() as cur:
-        cur.execute(sql, query["params"])
-        return jsonify(cur.fetchall())
+        sql += SQL(" WHERE ({})").format(query["query"])
+    with ExitStack() as stack:
+        cur = stack.enter_context(SimplePostgres(readonly=True))
+        # rows are received one by one in single-row mode, which works in
+        # autocommit mode but can't use a prepared statement
+        rows = cur.stream(sql, query["params"])
+        # cancels the query if the response isn't sent completely
+        stack.callback(rows.close)
+        return stream_rows(stack, rows)
+
+
+def update_query(table, values, where):
+    """
+    Builds an update query which sets 'values' on the rows matching 'where'
+    """
+    values = sorted(values.items())
+    update_params = [v for _, v in values]
+    update_str = SQL(",").join(
+        [SQL("{} = %s").format(Identifier(k)) for k, _ in values]
+    )
+
+    sql = SQL("UPDATE {} SET {}").format(sql_table(table), update_str)
+    # use an optional select string
+    query = QueryBuilder.build_query(where)
+    update_params.extend(query["params"])
+    if len(query["params"]) > 0:
+        sql += SQL(" WHERE ({})").format(query["query"])
+    sql += SQL(" RETURNING *")
+    return sql, update_params
 
 
 @app.route("/update", methods=["post"])
+@retry_stale_statements
 def update():
     req = request.json
     table = req["table"]
-    where = req.get("where", {})
-    values = sorted(req["values"].items())
-    update_params = list(map(lambda x: x[1], values))
-    update_str = ",".join(map(lambda x: f'"{x[0]}" = %s', values))
+    if req.get("batch") is True:
+        return _updateMany(table, req["values"], req["where"])
 
-    # use an optional select string
-    query = QueryBuilder.build_query(where)
-    update_params.extend(query["params"])
-    where_str = ""
-    if len(query["query"]) > 0:
-        where_str = f"WHERE ({query['query']}) "
-
-    sql = f"UPDATE {table} SET {update_str} {where_str}" "RETURNING *"
+    where = req.get("where", {})
+    sql, update_params = update_query(table, req["values"], where)
     with SimplePostgres() as cur:
-        cur.execute(sql, update_params)
+        cur.execute(sql, update_params, prepare=True)
         return jsonify(cur.fetchall())
 
 
+def _updateMany(table, values, where):
+    """
+    Applies every entry of 'values' to the rows matching the entry
+    of 'where' at the same position.
+    """
+    assert isinstance(values, list)
+    assert isinstance(where, list)
+    assert len(values) == len(where)
+    queries = [update_query(table, v, w) for v, w in zip(values, where)]
+    result = []
+    with SimplePostgres() as cur, ExitStack() as stack:
+        # every update gets its own cursor, so that all of them are sent
+        # in order before the first result is fetched
+        cursors = []
+        for sql, params in queries:
+            update_cur = stack.enter_context(cur.connection.cursor())
+            update_cur.execute(sql, params, prepare=True)
+            cursors.append(update_cur)
+        for update_cur in cursors:
+            result.extend(update_cur.fetchall())
+        return jsonify(result)
+
+
 @app.route("/tables/drop", methods=["post"])
 def tables_drop():
     req = request.json
     table = req["table"]
 
-    sql = f"DROP TABLE {table}"
+    sql = SQL("DROP TABLE {}").format(sql_table(table))
     with SimplePostgres() as cur:
         cur.execute(sql)
-        return jsonify([])
+    invalidate_statements()
+    return jsonify([])
 
 
 @app.route("/tables/create", methods=["post"])
@@ -302,16 +747,19 @@ def tables_create():
     req = request.json
     table = req["table"]
     columns = req["columns"]
-    columns_params = []
-
-    for k, v in sorted(columns.items()):
-        columns_params.append(f"{k} {str(v)}")
+    for k in columns:
+        assert check_valid_sql_ident(k)
 
-    columns_str = ",".join(columns_params)
-    sql = f"CREATE TABLE {table} ({columns_str})"
+    # the column types are passed through as SQL
+    columns_sql = SQL(",").join(
+        SQL("{} {}").format(Identifier(k), SQL(v if isinstance(v, str) else str(v)))
+        for k, v in sorted(columns.items())
+    )
+    sql = SQL("CREATE TABLE {} ({})").format(sql_table(table), columns_sql)
     with SimplePostgres() as cur:
         cur.execute(sql)
-        return jsonify({})
+    invalidate_statements()
+    return jsonify({})
 
 
 @app.route("/health", methods=["get"])
@@ -319,14 +767,31 @@ def health():
     return "OK"
 
 
+# Errors caused by invalid requests, which aren't worth a traceback
+_client_errors = (
+    AssertionError,
+    KeyError,
+    psycopg.DataError,
+    psycopg.IntegrityError,
+    psycopg.ProgrammingError,
+)
+
+
+@app.errorhandler(Exception)
 def app_error(e):
-    print(traceback.format_exc())
+    if isinstance(e, HTTPException):
+        return jsonify({"message": repr(e)}), e.code
+    if isinstance(e, _client_errors):
+        # only formatted if the log level includes INFO
+        app.logger.info("Invalid request: %r", e)
+    else:
+        app.logger.exception("Unhandled error")
     return jsonify({"message": repr(e)}), 400
 
 
 if __name__ == "__main__":
+    # Development server only, see gunicorn_conf.py for production use
     assert (
         "POSTGRES_DSN" in os.environ
     ), "The environment variable 'POSTGRES_DSN' must be set."
-    app.register_error_handler(Exception, app_error)
     app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn configuration for serving the app with gevent workers:
+
+    gunicorn -c gunicorn_conf.py app:app
+
+which is equivalent to
+`gunicorn -k gevent -w $(nproc) --worker-connections 100 app:app`.
+"""
+
+import multiprocessing
+import os
+
+bind = "0.0.0.0:8000"
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 100))
+
+# The connection pool is created lazily, hence once per worker, and
+# psycopg waits cooperatively once gevent has patched the select module.
+# All workers share PostgreSQL's max_connections (100 by default), so each
+# gets an equal part of PG_MAX_CONNECTIONS. Greenlets wait for a free
+# connection when their worker's pool is exhausted.
+pg_max_connections = int(os.environ.get("PG_MAX_CONNECTIONS", 80))
+os.environ.setdefault("PG_POOL_MAX", str(max(pg_max_connections // workers, 1)))
+
+
+def on_starting(server):
+    assert (
+        "POSTGRES_DSN" in os.environ
+    ), "The environment variable 'POSTGRES_DSN' must be set."